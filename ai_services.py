@@ -1,5 +1,14 @@
+import hashlib
 import os
+import orjson
+import re
+import threading
+import time
+from concurrent.futures import Future
 import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,65 +16,290 @@ load_dotenv()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 HF_API_KEY = os.getenv("HF_API_KEY")
 
+GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", "8"))
+GROQ_MAX_RETRIES = 2
+GROQ_BACKOFF_FACTOR = 0.3
+GROQ_RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+GROQ_POOL_CONNECTIONS = 10
+GROQ_POOL_MAXSIZE = 20
+
 # -------------------------
-# GROQ GENERATION FUNCTION
+# POOLED HTTP SESSION
+# -------------------------
+# One keep-alive session, kept across reruns by st.cache_resource, so repeated
+# Groq calls reuse the TCP/TLS connection instead of handshaking on every
+# request. The adapter itself never retries: connect failures, timeouts and
+# retryable statuses are all retried in groq_complete, where every attempt
+# is clipped to the time left before the call's deadline.
+@st.cache_resource
+def get_http_session():
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=GROQ_POOL_CONNECTIONS,
+        pool_maxsize=GROQ_POOL_MAXSIZE,
+        max_retries=Retry(total=0, raise_on_status=False)
+    ))
+    return session
+
+
 # -------------------------
-def groq_generate(prompt):
-    url = "https://api.groq.com/openai/v1/chat/completions"
+# GROQ REQUEST HELPERS
+# -------------------------
+GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
+DEFAULT_MODEL = "llama-3.1-8b-instant"
+DEFAULT_TEMPERATURE = 0.7
+
+# Short prompts with a small output budget go to FAST_MODEL; long or
+# open-ended ones go to LONG_MODEL, which can be pointed at a larger model.
+FAST_MODEL = DEFAULT_MODEL
+LONG_MODEL = os.getenv("GROQ_LONG_MODEL", DEFAULT_MODEL)
+LONG_PROMPT_CHARS = 2000
+LONG_OUTPUT_TOKENS = 200
 
-    headers = {
+
+class GroqAPIError(Exception):
+    pass
+
+
+def pick_model(prompt, expected_out=None):
+    if len(prompt) > LONG_PROMPT_CHARS or expected_out is None or expected_out > LONG_OUTPUT_TOKENS:
+        return LONG_MODEL
+    return FAST_MODEL
+
+
+def _groq_headers():
+    return {
         "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json"
+        "Content-Type": "application/json",
+        "Connection": "keep-alive"
     }
 
-    data = {
-        "model": "llama-3.1-8b-instant",
+
+def _groq_payload(prompt, model=None, temperature=DEFAULT_TEMPERATURE, max_tokens=None, stop=None):
+    payload = {
+        "model": model or pick_model(prompt, max_tokens),
         "messages": [
             {"role": "system", "content": "You are a business intelligence AI assistant."},
             {"role": "user", "content": prompt}
         ],
-        "temperature": 0.7
+        "temperature": temperature
     }
+    if max_tokens is not None:
+        payload["max_tokens"] = max_tokens
+    if stop is not None:
+        payload["stop"] = stop
+    return payload
 
-    try:
-        response = requests.post(url, headers=headers, json=data, timeout=30)
-        result = response.json()
 
-        if "choices" in result:
-            return result["choices"][0]["message"]["content"]
-        elif "error" in result:
-            return f"Groq API Error: {result['error']['message']}"
+def _parse_groq_result(result):
+    if "choices" in result:
+        return result["choices"][0]["message"]["content"]
+    elif "error" in result:
+        raise GroqAPIError(f"Groq API Error: {result['error']['message']}")
+    else:
+        raise GroqAPIError(f"Unexpected response: {result}")
+
+
+# -------------------------
+# GROQ GENERATION FUNCTION
+# -------------------------
+def _groq_post(prompt, model, temperature, max_tokens, stop, timeout, max_retries):
+    payload = _groq_payload(prompt, model, temperature, max_tokens, stop)
+    deadline = time.monotonic() + timeout * (max_retries + 1)
+
+    for attempt in range(max_retries + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise requests.Timeout(f"Groq request exceeded its {timeout * (max_retries + 1):.0f}s deadline")
+
+        try:
+            response = get_http_session().post(
+                GROQ_URL, headers=_groq_headers(), json=payload, timeout=min(timeout, remaining)
+            )
+        except (requests.Timeout, requests.ConnectionError):
+            if attempt == max_retries:
+                raise
         else:
-            return f"Unexpected response: {result}"
+            if response.status_code not in GROQ_RETRY_STATUSES or attempt == max_retries:
+                return _parse_groq_result(orjson.loads(response.content))
+            response.close()
+
+        time.sleep(min(GROQ_BACKOFF_FACTOR * (2 ** attempt), max(0, deadline - time.monotonic())))
+
+
+# Identical requests that are already in flight (e.g. the same Dashboard
+# insight from several sessions) share one HTTP call: the first caller sends
+# it on its own thread and later callers wait on its Future.
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def groq_complete(prompt, model=None, temperature=DEFAULT_TEMPERATURE, max_tokens=None, stop=None,
+                  timeout=GROQ_TIMEOUT, max_retries=GROQ_MAX_RETRIES):
+    """Like groq_generate, but raises on failure instead of returning the error text.
+
+    Connect failures, timeouts and retryable statuses are retried with
+    exponential backoff until a deadline of ``timeout * (max_retries + 1)``
+    seconds. No attempt starts after the deadline, and each attempt's connect
+    and read timeouts are clipped to the time left. Because requests times the
+    connect and read phases separately, the final attempt can overrun the
+    deadline by at most one phase.
 
+    With no ``model``, one is chosen by pick_model from the prompt and
+    ``max_tokens``. A call matching one already in flight waits for that
+    call's result.
+    """
+    key = hashlib.blake2b(repr((prompt, model, temperature, max_tokens, stop)).encode()).digest()
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[key] = future
+    if not owner:
+        return future.result()
+
+    try:
+        result = _groq_post(prompt, model, temperature, max_tokens, stop, timeout, max_retries)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+
+def groq_generate(prompt, model=None, temperature=DEFAULT_TEMPERATURE, max_tokens=None, stop=None,
+                  timeout=GROQ_TIMEOUT, max_retries=GROQ_MAX_RETRIES):
+    try:
+        return groq_complete(prompt, model, temperature, max_tokens, stop, timeout, max_retries)
+
+    except GroqAPIError as e:
+        return str(e)
     except Exception as e:
         return f"Exception occurred: {str(e)}"
 
 
+# -------------------------
+# STREAMING GROQ GENERATION
+# -------------------------
+def groq_stream(prompt, model=None, temperature=DEFAULT_TEMPERATURE, max_tokens=None, stop=None,
+                timeout=GROQ_TIMEOUT):
+    """Yield completion text as it arrives; closing the generator closes the connection."""
+    payload = _groq_payload(prompt, model, temperature, max_tokens, stop)
+    payload["stream"] = True
+
+    try:
+        with get_http_session().post(GROQ_URL, headers=_groq_headers(), json=payload,
+                           timeout=timeout, stream=True) as response:
+            if response.status_code != 200:
+                _parse_groq_result(orjson.loads(response.content))
+
+            for line in response.iter_lines():
+                if not line.startswith(b"data: "):
+                    continue
+                data = line[6:]
+                if data == b"[DONE]":
+                    break
+                content = orjson.loads(data)["choices"][0]["delta"].get("content")
+                if content:
+                    yield content
+
+    except GroqAPIError as e:
+        yield str(e)
+    except Exception as e:
+        yield f"Exception occurred: {str(e)}"
+
+
+# -------------------------
+# LOCAL LEAD INTENT RULES
+# -------------------------
+# Clear-cut lead descriptions are classified locally; only ambiguous ones
+# need a Groq round-trip. Only multi-word phrases count, since single words
+# such as "curious" or "follow-up" depend on context. A phrase preceded by a
+# negation ("not ready to buy") is never trusted locally either.
+HIGH_INTENT_RE = re.compile(
+    r"\b(buy now|ready to (buy|purchase)|need (it|this) urgently|urgent (requirement|purchase)|"
+    r"signing the (contract|agreement|deal)|budget (is |has been )?approved|"
+    r"request(ed)? (a )?(quote|contract))\b",
+    re.I
+)
+MEDIUM_INTENT_RE = re.compile(
+    r"\b(evaluating (vendors|solutions|options|tools)|comparing (vendors|solutions|options|quotes)|"
+    r"interested in (a demo|pricing|a quote|learning more)|schedul(e|ing) a demo)\b",
+    re.I
+)
+LOW_INTENT_RE = re.compile(
+    r"\b(just (researching|browsing|looking)|maybe next year|no budget|not interested|"
+    r"unsubscribe me|student project)\b",
+    re.I
+)
+NEGATION_RE = re.compile(r"\b(not|no|never)\b|n't\b", re.I)
+NEGATION_WINDOW = 30
+
+LEAD_SCORES = {"High Intent": 90, "Medium Intent": 65, "Low Intent": 30}
+
+_LEAD_PROMPT = """
+Analyze this business lead and classify the buying intent.
+
+Lead:
+{description}
+
+Classify as one of:
+- High Intent
+- Medium Intent
+- Low Intent
+
+Respond with only one label.
+""".format
+
+
+def _local_lead_intent(description):
+    hits = set()
+    for intent, pattern in (
+        ("High Intent", HIGH_INTENT_RE),
+        ("Medium Intent", MEDIUM_INTENT_RE),
+        ("Low Intent", LOW_INTENT_RE)
+    ):
+        for match in pattern.finditer(description):
+            if NEGATION_RE.search(description, max(0, match.start() - NEGATION_WINDOW), match.start()):
+                return None
+            hits.add(intent)
+    if len(hits) == 1:
+        return hits.pop()
+    return None
+
+
 # -------------------------
 # HUGGING FACE LEAD SCORING
 # -------------------------
-def hf_lead_score(description):
+# The label is the whole answer: decode greedily and stop right after it.
+LEAD_MAX_TOKENS = 4
+LEAD_TEMPERATURE = 0.0
+LEAD_STOP = ["\n"]
 
-    prompt = f"""
-    Analyze this business lead and classify the buying intent.
 
-    Lead:
-    {description}
+def hf_lead_score(description, model=None, temperature=LEAD_TEMPERATURE, infer=True):
 
-    Classify as one of:
-    - High Intent
-    - Medium Intent
-    - Low Intent
+    intent = _local_lead_intent(description)
+    if intent is None and not infer:
+        intent = "Low Intent"
 
-    Respond with only one label.
-    """
+    if intent is not None:
+        return {"score": LEAD_SCORES[intent], "intent": intent}
 
-    result = groq_generate(prompt)
+    result = groq_complete(
+        _LEAD_PROMPT(description=description), model, temperature, LEAD_MAX_TOKENS, LEAD_STOP
+    )
 
     if "High" in result:
-        return {"score": 90, "intent": "High Intent"}
+        intent = "High Intent"
     elif "Medium" in result:
-        return {"score": 65, "intent": "Medium Intent"}
+        intent = "Medium Intent"
     else:
-        return {"score": 30, "intent": "Low Intent"}
\ No newline at end of file
+        intent = "Low Intent"
+    return {"score": LEAD_SCORES[intent], "intent": intent}
@@ -1,11 +1,14 @@
 import streamlit as st
+import csv
 import datetime
-import pandas as pd
-import matplotlib.pyplot as plt
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch
-from ai_services import groq_generate, hf_lead_score
+import io
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from ai_services import (
+    groq_generate, groq_complete, groq_stream, hf_lead_score,
+    DEFAULT_TEMPERATURE, LEAD_TEMPERATURE
+)
 
 st.set_page_config(page_title="MarketMind", layout="wide")
 
@@ -40,14 +43,64 @@ VALID_PAGES = [
     "History", "ChatHistory"
 ]
 
+# =============================
+# PROMPT TEMPLATES
+# =============================
+_INSIGHT_PROMPT = """
+Analyze usage:
+Total Searches: {total_tools}
+Total Chats: {total_chats}
+Monthly Activity: {monthly_usage}
+Suggest improvements.
+""".format
+
+_PITCH_PROMPT = """
+Create a startup investor pitch for MarketMind,
+an AI-powered Sales & Marketing Intelligence Platform.
+
+Traction:
+- Total Usage: {total_usage}
+- Monthly Activity: {monthly_usage}
+- Most Used Feature: {most_used}
+- Productivity Score: {productivity_score}
+
+Structure:
+1. Problem
+2. Solution
+3. Market Opportunity
+4. Traction
+5. Competitive Advantage
+6. Revenue Model
+7. Growth Plan
+8. Funding Ask
+
+Sound confident and investor-ready.
+""".format
+
+_CAMPAIGN_PROMPT = "Create marketing campaign for {product} targeting {audience}".format
+_SALES_PROMPT = "Create sales pitch for {product} targeting {persona}".format
+_SUMMARY_PROMPT = "Summarize: {content}".format
+_RESEARCH_PROMPT = "Business research on {query}".format
+_CHAT_SUMMARY_PROMPT = (
+    "Summarize this conversation, keeping every fact needed to continue it:\n{summary}\n{transcript}"
+).format
+
+# History is stored column-wise (one list per field) so the Dashboard can
+# aggregate it without walking a list of dicts.
+TOOL_HISTORY_FIELDS = ("feature", "input", "output", "date", "month", "time")
+CHAT_HISTORY_FIELDS = ("messages", "date", "month", "time")
+
 # =============================
 # SESSION INIT
 # =============================
 for key, default in {
     "page": DEFAULT_PAGE,
-    "tool_history": [],
-    "chat_history": [],
+    "tool_history": {field: [] for field in TOOL_HISTORY_FIELDS},
+    "chat_history": {field: [] for field in CHAT_HISTORY_FIELDS},
     "current_chat": [],
+    "chat_context": "",
+    "chat_summary": "",
+    "chat_summary_job": None,
     "selected_item": None
 }.items():
     if key not in st.session_state:
@@ -56,45 +109,196 @@ for key, default in {
 if st.session_state.page not in VALID_PAGES:
     st.session_state.page = DEFAULT_PAGE
 
+# =============================
+# CACHED API CALLS
+# =============================
+# The Dashboard insight prompt repeats on every render until usage changes,
+# and lead descriptions repeat while exploring, so identical calls are served
+# from cache. Failures raise and are therefore never cached.
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def _cached_groq(prompt, model=None, temperature=DEFAULT_TEMPERATURE, max_tokens=None):
+    return groq_complete(prompt, model, temperature, max_tokens)
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def _cached_lead_score(description, model=None, temperature=LEAD_TEMPERATURE):
+    return hf_lead_score(description, model, temperature)
+
+# =============================
+# BACKGROUND CALLS
+# =============================
+# A rerun can only interrupt this script at an st.* call, so blocking Groq
+# calls run on a helper thread while the script waits in short slices and
+# touches a placeholder between them. When a widget event supersedes the run,
+# that st.* call raises, the wait is abandoned and the late response is
+# dropped with the thread.
+GROQ_WAIT_SLICE = 0.2
+
+def run_in_background(fn, *args, **kwargs):
+    future = Future()
+
+    def target():
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    thread = threading.Thread(target=target, daemon=True)
+    add_script_run_ctx(thread, get_script_run_ctx())
+    thread.start()
+    return future
+
+def wait_for(*futures):
+    heartbeat = st.empty()
+    pending = futures
+    while pending:
+        _, pending = wait(pending, timeout=GROQ_WAIT_SLICE)
+        heartbeat.empty()
+    return futures
+
 # =============================
 # SAFE API WRAPPERS
 # =============================
 def safe_groq(prompt):
     try:
-        return groq_generate(prompt)
+        return wait_for(run_in_background(groq_generate, prompt))[0].result()
     except Exception as e:
         return f"⚠️ Groq API Error:\n{str(e)}"
 
-def safe_hf(description):
+def write_groq_stream(prompt):
+    # A widget event interrupts this run at the next st.* call, which closes
+    # the generator and with it the streaming connection.
+    return st.write_stream(groq_stream(prompt))
+
+INSIGHT_MAX_TOKENS = 400
+
+def _groq_result_or_error(future):
     try:
-        return hf_lead_score(description)
+        return future.result()
+    except Exception as e:
+        return f"⚠️ Groq API Error:\n{str(e)}"
+
+def safe_groq_dashboard(insight_prompt, pitch_prompt=None):
+    # The insight always goes through the prompt cache, so a pitch click does
+    # not re-sample it. On a cache miss it runs alongside the pitch call and
+    # the fresh result is stored for the next render.
+    futures = [run_in_background(_cached_groq, insight_prompt, max_tokens=INSIGHT_MAX_TOKENS)]
+    if pitch_prompt is not None:
+        futures.append(run_in_background(groq_complete, pitch_prompt))
+    results = [_groq_result_or_error(future) for future in wait_for(*futures)]
+    return results[0], (results[1] if pitch_prompt is not None else None)
+
+def safe_hf(description, cached=True):
+    try:
+        if not cached:
+            return hf_lead_score(description)
+        return wait_for(run_in_background(_cached_lead_score, description))[0].result()
     except Exception as e:
         return {"score": 0, "intent": f"Error: {str(e)}"}
 
+LEAD_BATCH_WORKERS = 10
+
+def read_leads(uploaded):
+    """Return (columns, rows) for a CSV upload, or (None, lines) for plain text."""
+    # Excel and other tools often export non-UTF-8 text; keep the readable parts.
+    text = uploaded.getvalue().decode("utf-8-sig", errors="replace")
+    if uploaded.name.lower().endswith(".csv"):
+        rows = [row for row in csv.reader(io.StringIO(text)) if any(cell.strip() for cell in row)]
+        return (rows[0], rows[1:]) if rows else ([], [])
+    return None, [line.strip() for line in text.splitlines() if line.strip()]
+
+def score_leads(leads):
+    # Uploaded batches rarely repeat, so workers call the scorer directly; they
+    # still share the st.cache_resource HTTP session with the script thread.
+    # If the run is superseded, leads that have not started yet are cancelled.
+    executor = ThreadPoolExecutor(max_workers=LEAD_BATCH_WORKERS)
+    try:
+        futures = [executor.submit(safe_hf, lead, cached=False) for lead in leads]
+        return [future.result() for future in wait_for(*futures)]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
 # =============================
 # HELPERS
 # =============================
+def append_history(history, **row):
+    for field, column in history.items():
+        column.append(row[field])
+
+def history_row(history, idx):
+    return {field: column[idx] for field, column in history.items()}
+
 def save_tool_history(feature, user_input, output):
     now = datetime.datetime.now()
-    st.session_state.tool_history.append({
-        "feature": feature,
-        "input": user_input,
-        "output": output,
-        "date": now.strftime("%Y-%m-%d"),
-        "month": now.strftime("%Y-%m"),
-        "time": now.strftime("%H:%M:%S")
-    })
+    append_history(
+        st.session_state.tool_history,
+        feature=feature,
+        input=user_input,
+        output=output,
+        date=now.strftime("%Y-%m-%d"),
+        month=now.strftime("%Y-%m"),
+        time=now.strftime("%H:%M:%S")
+    )
 
 def save_chat_history():
     if st.session_state.current_chat:
         now = datetime.datetime.now()
-        st.session_state.chat_history.append({
-            "messages": st.session_state.current_chat.copy(),
-            "date": now.strftime("%Y-%m-%d"),
-            "month": now.strftime("%Y-%m"),
-            "time": now.strftime("%H:%M:%S")
-        })
+        append_history(
+            st.session_state.chat_history,
+            messages=st.session_state.current_chat.copy(),
+            date=now.strftime("%Y-%m-%d"),
+            month=now.strftime("%Y-%m"),
+            time=now.strftime("%H:%M:%S")
+        )
         st.session_state.current_chat = []
+        st.session_state.chat_context = ""
+        st.session_state.chat_summary = ""
+        st.session_state.chat_summary_job = None
+
+# Once the running transcript passes CHAT_CONTEXT_LIMIT characters, its oldest
+# lines (about CHAT_SUMMARY_CHUNK characters) are summarized in the background
+# and replaced by the summary, so prompts stop growing with the chat.
+CHAT_CONTEXT_LIMIT = 4000
+CHAT_SUMMARY_CHUNK = 3000
+
+@st.cache_resource
+def get_summary_executor():
+    return ThreadPoolExecutor(max_workers=2)
+
+def append_chat_context(role, content):
+    st.session_state.chat_context += f"\n{role}: {content}"
+
+def fold_chat_summary():
+    job = st.session_state.chat_summary_job
+    if job is None or not job[0].done():
+        return
+    future, cut = job
+    st.session_state.chat_summary_job = None
+    if future.exception() is None:
+        st.session_state.chat_summary = future.result()
+        st.session_state.chat_context = st.session_state.chat_context[cut:]
+
+def compress_chat_context():
+    context = st.session_state.chat_context
+    if st.session_state.chat_summary_job is not None or len(context) <= CHAT_CONTEXT_LIMIT:
+        return
+    # Cut on a line boundary so neither the summary nor the kept tail starts
+    # or ends mid-message; fall forward if one long message spans the chunk.
+    cut = context.rfind("\n", 0, CHAT_SUMMARY_CHUNK)
+    if cut <= 0:
+        cut = context.find("\n", CHAT_SUMMARY_CHUNK)
+    if cut <= 0:
+        return
+    prompt = _CHAT_SUMMARY_PROMPT(
+        summary=st.session_state.chat_summary, transcript=context[:cut].lstrip("\n")
+    )
+    future = get_summary_executor().submit(groq_complete, prompt)
+    st.session_state.chat_summary_job = (future, cut)
+
+def chat_prompt(user_input):
+    context = f"{st.session_state.chat_context}\nuser: {user_input}".lstrip("\n")
+    if st.session_state.chat_summary:
+        return f"Summary of earlier conversation:\n{st.session_state.chat_summary}\n\n{context}"
+    return context
 
 def download_output(title, content):
     st.download_button(
@@ -103,23 +307,47 @@ def download_output(title, content):
         file_name=f"{title}_{datetime.datetime.now().strftime('%H%M%S')}.txt"
     )
 
+# pandas and reportlab are imported where they are used, so pages that never
+# chart or export a PDF do not pay for loading them.
+@st.cache_resource
+def get_styles():
+    from reportlab.lib.styles import getSampleStyleSheet
+    return getSampleStyleSheet()
+
 def generate_pdf_report(title, text):
-    filename = f"{title}.pdf"
-    doc = SimpleDocTemplate(filename)
-    styles = getSampleStyleSheet()
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Preformatted, Spacer
+    from reportlab.lib.units import inch
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer)
+    styles = get_styles()
     story = []
     story.append(Paragraph(f"<b>{title}</b>", styles["Title"]))
     story.append(Spacer(1, 0.5 * inch))
-    story.append(Paragraph(text.replace("\n", "<br/>"), styles["Normal"]))
+    # Preformatted skips reportlab's markup parser, which is slow on long outputs
+    # and chokes on stray "<" or "&" in model text. Code is a monospace style,
+    # so the wrap width is the frame width divided by one character's width.
+    body_style = styles["Code"]
+    usable_width = doc.width - body_style.leftIndent - body_style.rightIndent
+    max_line_length = int(usable_width // stringWidth("M", body_style.fontName, body_style.fontSize))
+    story.append(Preformatted(text, body_style, maxLineLength=max_line_length))
     doc.build(story)
 
-    with open(filename, "rb") as f:
-        st.download_button(
-            f"📄 Download {title} PDF",
-            f,
-            file_name=filename,
-            mime="application/pdf"
-        )
+    st.download_button(
+        f"📄 Download {title} PDF",
+        buffer.getvalue(),
+        file_name=f"{title}.pdf",
+        mime="application/pdf"
+    )
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def dashboard_stats(features, tool_months, chat_months, current_month):
+    import pandas as pd
+
+    feature_counts = pd.Series(features, dtype=object).value_counts()
+    monthly_usage = tool_months.count(current_month) + chat_months.count(current_month)
+    return feature_counts, monthly_usage
 
 def go(page, keep=False):
     if page in VALID_PAGES:
@@ -128,6 +356,42 @@ def go(page, keep=False):
             st.session_state.selected_item = None
         st.rerun()
 
+# =============================
+# FRAGMENTS
+# =============================
+# Interactions inside a fragment rerun only that fragment, not the whole
+# script. Navigation still goes through go(), which needs a full rerun.
+@st.fragment
+def history_panel():
+    tool_history = st.session_state.tool_history
+    for idx in reversed(range(len(tool_history["feature"]))):
+        if st.button(f"{tool_history['feature'][idx]} ({tool_history['time'][idx]})", key=f"tool_{idx}"):
+            st.session_state.selected_item = history_row(tool_history, idx)
+            go("History", keep=True)
+
+    chat_history = st.session_state.chat_history
+    for idx in reversed(range(len(chat_history["time"]))):
+        if st.button(f"💬 Chat ({chat_history['time'][idx]})", key=f"chat_{idx}"):
+            st.session_state.selected_item = history_row(chat_history, idx)
+            go("ChatHistory", keep=True)
+
+@st.fragment
+def chat_panel():
+    st.title("💬 AI Chat")
+    user_input = st.text_input("Message")
+    if st.button("Send"):
+        if user_input:
+            fold_chat_summary()
+            response = safe_groq(chat_prompt(user_input))
+            st.session_state.current_chat.append({"role": "user", "content": user_input})
+            st.session_state.current_chat.append({"role": "assistant", "content": response})
+            append_chat_context("user", user_input)
+            append_chat_context("assistant", response)
+            compress_chat_context()
+    for msg in st.session_state.current_chat:
+        role = "You" if msg["role"] == "user" else "AI"
+        st.write(f"**{role}:** {msg['content']}")
+
 # =============================
 # SIDEBAR
 # =============================
@@ -150,15 +414,8 @@ for label, page in nav_items:
 st.sidebar.markdown("---")
 st.sidebar.subheader("History")
 
-for idx, item in enumerate(reversed(st.session_state.tool_history)):
-    if st.sidebar.button(f"{item['feature']} ({item['time']})", key=f"tool_{idx}"):
-        st.session_state.selected_item = item
-        go("History", keep=True)
-
-for idx, chat in enumerate(reversed(st.session_state.chat_history)):
-    if st.sidebar.button(f"💬 Chat ({chat['time']})", key=f"chat_{idx}"):
-        st.session_state.selected_item = chat
-        go("ChatHistory", keep=True)
+with st.sidebar:
+    history_panel()
 
 # =============================
 # ROUTER
@@ -175,33 +432,30 @@ if page == "Dashboard":
     tool_data = st.session_state.tool_history
     chat_data = st.session_state.chat_history
 
-    total_tools = len(tool_data)
-    total_chats = len(chat_data)
+    total_tools = len(tool_data["feature"])
+    total_chats = len(chat_data["month"])
     total_usage = total_tools + total_chats
 
     current_month = datetime.datetime.now().strftime("%Y-%m")
 
-    monthly_usage = [
-        item for item in tool_data if item["month"] == current_month
-    ] + [
-        chat for chat in chat_data if chat["month"] == current_month
-    ]
+    feature_counts, monthly_usage = dashboard_stats(
+        tuple(tool_data["feature"]),
+        tuple(tool_data["month"]),
+        tuple(chat_data["month"]),
+        current_month
+    )
 
     col1, col2, col3 = st.columns(3)
     col1.metric("Total Searches", total_tools)
     col2.metric("Total Chats", total_chats)
-    col3.metric("This Month Activity", len(monthly_usage))
+    col3.metric("This Month Activity", monthly_usage)
 
     most_used = "N/A"
 
-    if tool_data:
-        df = pd.DataFrame(tool_data)
-        feature_counts = df["feature"].value_counts()
+    if total_tools:
 
         st.subheader("📈 Feature Usage Distribution")
-        fig, ax = plt.subplots()
-        feature_counts.plot(kind="bar", ax=ax)
-        st.pyplot(fig)
+        st.bar_chart(feature_counts)
 
         most_used = feature_counts.idxmax()
         st.success(f"🔥 Most Used Feature: {most_used}")
@@ -212,14 +466,22 @@ if page == "Dashboard":
         st.metric("⚡ Productivity Score", f"{productivity_score}/100")
 
         # AI Usage Insight
-        insight_prompt = f"""
-        Analyze usage:
-        Total Searches: {total_tools}
-        Total Chats: {total_chats}
-        Monthly Activity: {len(monthly_usage)}
-        Suggest improvements.
-        """
-        insights = safe_groq(insight_prompt)
+        insight_prompt = _INSIGHT_PROMPT(
+            total_tools=total_tools, total_chats=total_chats, monthly_usage=monthly_usage
+        )
+
+        # The pitch button latches into session state before the rerun, so
+        # both prompts can be sent together instead of back to back.
+        pitch_prompt = None
+        if st.session_state.get("pitch_button"):
+            pitch_prompt = _PITCH_PROMPT(
+                total_usage=total_usage,
+                monthly_usage=monthly_usage,
+                most_used=most_used,
+                productivity_score=productivity_score
+            )
+
+        insights, pitch = safe_groq_dashboard(insight_prompt, pitch_prompt)
 
         st.subheader("🧠 AI Usage Insights")
         st.write(insights)
@@ -231,32 +493,7 @@ if page == "Dashboard":
         st.markdown("---")
         st.subheader("💼 Mock Investor Pitch Mode")
 
-        if st.button("🚀 Generate Investor Pitch"):
-
-            pitch_prompt = f"""
-            Create a startup investor pitch for MarketMind,
-            an AI-powered Sales & Marketing Intelligence Platform.
-
-            Traction:
-            - Total Usage: {total_usage}
-            - Monthly Activity: {len(monthly_usage)}
-            - Most Used Feature: {most_used}
-            - Productivity Score: {productivity_score}
-
-            Structure:
-            1. Problem
-            2. Solution
-            3. Market Opportunity
-            4. Traction
-            5. Competitive Advantage
-            6. Revenue Model
-            7. Growth Plan
-            8. Funding Ask
-
-            Sound confident and investor-ready.
-            """
-
-            pitch = safe_groq(pitch_prompt)
+        if st.button("🚀 Generate Investor Pitch", key="pitch_button") and pitch is not None:
 
             st.markdown("### 🎤 Investor Pitch Script")
             st.write(pitch)
@@ -307,9 +544,8 @@ elif page == "Campaign":
     product = st.text_input("Product")
     audience = st.text_area("Audience")
     if st.button("Generate"):
-        prompt = f"Create marketing campaign for {product} targeting {audience}"
-        result = safe_groq(prompt)
-        st.write(result)
+        prompt = _CAMPAIGN_PROMPT(product=product, audience=audience)
+        result = write_groq_stream(prompt)
         download_output("Campaign", result)
         save_tool_history("Campaign", prompt, result)
 
@@ -321,9 +557,8 @@ elif page == "Sales":
     product = st.text_input("Product")
     persona = st.text_area("Persona")
     if st.button("Generate"):
-        prompt = f"Create sales pitch for {product} targeting {persona}"
-        result = safe_groq(prompt)
-        st.write(result)
+        prompt = _SALES_PROMPT(product=product, persona=persona)
+        result = write_groq_stream(prompt)
         download_output("Sales_Pitch", result)
         save_tool_history("Sales", prompt, result)
 
@@ -339,6 +574,30 @@ elif page == "Lead":
         st.write(output)
         save_tool_history("Lead", description, output)
 
+    st.markdown("---")
+    st.subheader("Batch Scoring")
+    uploaded = st.file_uploader(
+        "Leads file (.txt with one lead per line, or .csv with a header row)", type=["txt", "csv"]
+    )
+    leads = []
+    if uploaded is not None:
+        columns, leads = read_leads(uploaded)
+        if columns is not None:
+            column = st.selectbox("Lead description column", range(len(columns)),
+                                  format_func=lambda i: columns[i] or f"Column {i + 1}")
+            rows = leads if column is not None else []
+            leads = [row[column].strip() for row in rows if len(row) > column and row[column].strip()]
+    if leads and st.button("Score All"):
+        results = score_leads(leads)
+        rows = [
+            {"Lead": lead, "Score": result.get("score", 0), "Intent": result.get("intent", "")}
+            for lead, result in zip(leads, results)
+        ]
+        st.dataframe(rows, use_container_width=True)
+        output = "\n".join(f"{row['Lead']} | Score: {row['Score']} | Intent: {row['Intent']}" for row in rows)
+        download_output("Lead_Scores", output)
+        save_tool_history("Lead", f"{len(leads)} leads from {uploaded.name}", output)
+
 # =============================
 # SUMMARY
 # =============================
@@ -346,8 +605,7 @@ elif page == "Summary":
     st.title("Executive Summary")
     content = st.text_area("Content")
     if st.button("Generate"):
-        result = safe_groq(f"Summarize: {content}")
-        st.write(result)
+        result = write_groq_stream(_SUMMARY_PROMPT(content=content))
         download_output("Summary", result)
         save_tool_history("Summary", content, result)
 
@@ -358,8 +616,7 @@ elif page == "Research":
     st.title("Business Research")
     query = st.text_input("Research Topic")
     if st.button("Search"):
-        result = safe_groq(f"Business research on {query}")
-        st.write(result)
+        result = write_groq_stream(_RESEARCH_PROMPT(query=query))
         download_output("Research", result)
         save_tool_history("Research", query, result)
 
@@ -367,18 +624,8 @@ elif page == "Research":
 # CHAT
 # =============================
 elif page == "Chat":
-    st.title("💬 AI Chat")
-    user_input = st.text_input("Message")
-    if st.button("Send"):
-        if user_input:
-            st.session_state.current_chat.append({"role": "user", "content": user_input})
-            context = "\n".join([f"{m['role']}: {m['content']}" for m in st.session_state.current_chat])
-            response = safe_groq(context)
-            st.session_state.current_chat.append({"role": "assistant", "content": response})
-            st.rerun()
-    for msg in st.session_state.current_chat:
-        role = "You" if msg["role"] == "user" else "AI"
-        st.write(f"**{role}:** {msg['content']}")
-    if st.button("Save Chat"):
-        save_chat_history()
-        st.success("Chat saved.")
\ No newline at end of file
+    chat_panel()
+    # Kept outside the fragment and saved in on_click, so the full rerun that
+    # follows already lists the chat in the sidebar history.
+    if st.button("Save Chat", on_click=save_chat_history):
+        st.success("Chat saved.")